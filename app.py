@@ -6,25 +6,72 @@ Version UNIVERSELLE - Gère TOUS les formats de geopackage
 """
 
 from flask import Flask, render_template, request, jsonify, send_file
+from flask.json.provider import DefaultJSONProvider
 from flask_cors import CORS
 import sqlite3
-import geopandas as gpd
-import pandas as pd
-from shapely.geometry import shape, mapping
-from shapely.ops import unary_union
 import json
 import io
+import base64
+import gzip
+import hashlib
+import zlib
+import shutil
+import tempfile
 from datetime import datetime
 import os
 
+# Accélérateurs optionnels pour les réponses JSON
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# NB: geopandas / pandas / shapely / openpyxl sont importés dans les routes
+# qui en ont besoin (upload, export): les routes légères et le boot des
+# workers ne paient pas le chargement de GDAL/PROJ. Voir warmup_geospatial().
+
+class OrjsonProvider(DefaultJSONProvider):
+    """Sérialisation JSON via orjson (beaucoup plus rapide que json)"""
+    
+    options = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY if orjson else 0
+    
+    def dumps(self, obj, **kwargs):
+        if kwargs:
+            return super().dumps(obj, **kwargs)
+        return orjson.dumps(obj, default=self.default, option=self.options).decode()
+    
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        data = orjson.dumps(obj, default=self.default, option=self.options)
+        return self._app.response_class(data, mimetype=self.mimetype)
+
 app = Flask(__name__)
+if orjson:
+    app.json = OrjsonProvider(app)
 CORS(app)
 
 # Configuration
 DATABASE_PATH = 'data/enquete_parcellaire.db'
 UPLOAD_FOLDER = 'data/uploads'
+SNAPSHOT_FOLDER = 'data/snapshots'
 os.makedirs('data', exist_ok=True)
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+os.makedirs(SNAPSHOT_FOLDER, exist_ok=True)
+
+# Snapshots: découpage aux pages SQLite (taille lue dans l'en-tête du fichier)
+CHUNK_SIZE_DEFAUT = 4096
+CHUNK_COMPRESSION_LEVEL = 6
+
+# Réponses API: compression et pagination
+COMPRESSION_MIN_SIZE = 500
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+HISTORIQUE_LIMIT_MAX = 1000
 
 # Configuration des zones
 ZONES_CONFIG = {
@@ -74,6 +121,8 @@ def get_field_value(row, field_mappings):
     Récupère une valeur depuis un row, en testant plusieurs noms possibles
     field_mappings: liste de noms possibles pour le champ
     """
+    import pandas as pd
+    
     for field_name in field_mappings:
         if field_name in row.index:
             val = row.get(field_name)
@@ -126,12 +175,11 @@ FIELD_MAPPINGS = {
 # BASE DE DONNÉES
 # ============================================================================
 
-def init_database():
-    """Initialiser la base de données"""
-    conn = sqlite3.connect(DATABASE_PATH)
-    cursor = conn.cursor()
-    
-    cursor.execute('''
+# Migrations versionnées: (version, description, requêtes SQL)
+# Ne jamais modifier une migration existante, toujours en ajouter une nouvelle.
+MIGRATIONS = [
+    (1, 'Tables initiales', [
+        '''
         CREATE TABLE IF NOT EXISTS zones (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             province TEXT NOT NULL,
@@ -141,27 +189,11 @@ def init_database():
             date_debut_enquete DATE,
             surface_totale_ha REAL,
             geom_limite TEXT,
-            cloturee INTEGER DEFAULT 0,
-            date_cloture DATE,
             last_update TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
             UNIQUE(province, code_zone)
         )
-    ''')
-    
-    # MIGRATION: Ajouter colonnes si elles manquent
-    try:
-        cursor.execute("SELECT cloturee FROM zones LIMIT 1")
-    except sqlite3.OperationalError:
-        print("🔧 Migration: Ajout colonne 'cloturee'")
-        cursor.execute("ALTER TABLE zones ADD COLUMN cloturee INTEGER DEFAULT 0")
-    
-    try:
-        cursor.execute("SELECT date_cloture FROM zones LIMIT 1")
-    except sqlite3.OperationalError:
-        print("🔧 Migration: Ajout colonne 'date_cloture'")
-        cursor.execute("ALTER TABLE zones ADD COLUMN date_cloture DATE")
-    
-    cursor.execute('''
+        ''',
+        '''
         CREATE TABLE IF NOT EXISTS enquete_actuelle (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             province TEXT NOT NULL,
@@ -176,10 +208,9 @@ def init_database():
             last_update TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
             UNIQUE(province, code_zone)
         )
-    ''')
-    
-    # Table historique pour garder trace de chaque upload
-    cursor.execute('''
+        ''',
+        # Table historique pour garder trace de chaque upload
+        '''
         CREATE TABLE IF NOT EXISTS historique_uploads (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             province TEXT NOT NULL,
@@ -192,11 +223,453 @@ def init_database():
             surface_ajoutee_ha REAL,
             timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
         )
+        '''
+    ]),
+    # 2 et 3 remplacent les anciennes migrations par sondage (SELECT ... LIMIT 1):
+    # sur une base existante, la colonne peut déjà avoir été ajoutée
+    (2, "Ajout colonne 'cloturee'", [
+        "ALTER TABLE zones ADD COLUMN cloturee INTEGER DEFAULT 0"
+    ]),
+    (3, "Ajout colonne 'date_cloture'", [
+        "ALTER TABLE zones ADD COLUMN date_cloture DATE"
+    ]),
+    # Snapshots quotidiens: chunks dédupliqués et compressés
+    (4, 'Tables snapshots', [
+        '''
+        CREATE TABLE IF NOT EXISTS snapshot_chunks (
+            hash TEXT PRIMARY KEY,
+            taille_brute INTEGER NOT NULL,
+            taille_compressee INTEGER NOT NULL,
+            data BLOB NOT NULL
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS snapshots (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            province TEXT NOT NULL,
+            code_zone TEXT NOT NULL,
+            numero_jour INTEGER,
+            date_snapshot DATE NOT NULL,
+            taille_brute INTEGER,
+            sha256 TEXT,
+            timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            UNIQUE(province, code_zone, date_snapshot)
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS snapshot_chunk_refs (
+            snapshot_id INTEGER NOT NULL,
+            position INTEGER NOT NULL,
+            hash TEXT NOT NULL,
+            PRIMARY KEY(snapshot_id, position)
+        )
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_snapshot_chunk_refs_hash ON snapshot_chunk_refs(hash)'
+    ]),
+    # Historique d'une zone trié par (date_maj, id): dernier upload et pagination
+    (5, 'Index historique_uploads par zone', [
+        '''
+        CREATE INDEX IF NOT EXISTS idx_historique_uploads_zone
+        ON historique_uploads(province, code_zone, date_maj, id)
+        '''
+    ])
+]
+
+# Migrations déjà appliquées par l'ancien code sur les bases existantes
+MIGRATIONS_HERITEES = {2, 3}
+
+def init_database():
+    """
+    Initialiser la base de données (applique les migrations manquantes).
+    Chaque migration s'exécute dans sa propre transaction (le DDL SQLite est
+    transactionnel): en cas d'échec, rien n'est appliqué ni enregistré.
+    """
+    conn = sqlite3.connect(DATABASE_PATH)
+    # Transactions explicites: sinon sqlite3 valide chaque CREATE/ALTER à part
+    conn.isolation_level = None
+    cursor = conn.cursor()
+    
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INTEGER PRIMARY KEY,
+            description TEXT,
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
     ''')
     
+    cursor.execute("SELECT COALESCE(MAX(version), 0) FROM schema_migrations")
+    version_actuelle = cursor.fetchone()[0]
+    
+    try:
+        for version, description, requetes in MIGRATIONS:
+            if version <= version_actuelle:
+                continue
+            
+            print(f"🔧 Migration {version}: {description}")
+            cursor.execute('BEGIN')
+            for sql in requetes:
+                try:
+                    cursor.execute(sql)
+                except sqlite3.OperationalError as e:
+                    # Bases créées avant la table schema_migrations:
+                    # la colonne a déjà été ajoutée par l'ancien code
+                    if version not in MIGRATIONS_HERITEES or 'duplicate column name' not in str(e):
+                        raise
+            
+            cursor.execute('''
+                INSERT INTO schema_migrations (version, description)
+                VALUES (?, ?)
+            ''', (version, description))
+            cursor.execute('COMMIT')
+    except Exception:
+        if conn.in_transaction:
+            cursor.execute('ROLLBACK')
+        raise
+    finally:
+        conn.close()
+    
+    print("✅ Base de données initialisée!")
+
+def warmup_geospatial():
+    """
+    Précharge la pile géospatiale (pandas, geopandas, shapely, openpyxl)
+    et initialise PROJ / GDAL, pour que la première requête d'upload ou
+    d'export ne paie pas ce coût. Appelé depuis gunicorn.conf.py.
+    """
+    import pandas  # noqa: F401
+    import openpyxl  # noqa: F401
+    import geopandas as gpd
+    from shapely.geometry import Point
+    
+    # Charge la base PROJ et le CRS utilisé partout dans l'application
+    gpd.GeoSeries([Point(0, 0)], crs='EPSG:4326').to_crs('EPSG:26191')
+    
+    # Enregistre les drivers GDAL (lecture des geopackages)
+    try:
+        import pyogrio
+        pyogrio.list_drivers()
+    except ImportError:
+        import fiona
+        fiona.supported_drivers  # noqa: B018
+
+# ============================================================================
+# SNAPSHOTS: HISTORIQUE DES GEOPACKAGES (dédupliqué + compressé)
+# ============================================================================
+
+SQLITE_HEADER = b'SQLite format 3\x00'
+
+def taille_page_sqlite(data):
+    """Taille de page d'un fichier SQLite (octets 16-17 de l'en-tête, 1 = 65536)"""
+    if len(data) < 18 or data[:16] != SQLITE_HEADER:
+        return CHUNK_SIZE_DEFAUT
+    taille = int.from_bytes(data[16:18], 'big')
+    return 65536 if taille == 1 else taille
+
+def decouper_chunks(data):
+    """
+    Découpe des octets en chunks alignés sur les pages SQLite.
+    Un geopackage est une base SQLite modifiée page par page: les pages
+    inchangées d'un jour à l'autre donnent des chunks identiques, dédupliqués.
+    """
+    taille = taille_page_sqlite(data)
+    return [data[i:i + taille] for i in range(0, len(data), taille)]
+
+def enregistrer_snapshot(cursor, province, code_zone, numero_jour, date_snapshot, gpkg_path):
+    """
+    Archive le geopackage uploadé comme snapshot du jour.
+    Seuls les chunks inconnus sont compressés et stockés.
+    Un nouvel upload le même jour remplace le snapshot de ce jour.
+    """
+    with open(gpkg_path, 'rb') as f:
+        data = f.read()
+    
+    cursor.execute('''
+        SELECT id FROM snapshots
+        WHERE province = ? AND code_zone = ? AND date_snapshot = ?
+    ''', (province, code_zone, date_snapshot))
+    ancien = cursor.fetchone()
+    if ancien:
+        cursor.execute('DELETE FROM snapshot_chunk_refs WHERE snapshot_id = ?', (ancien[0],))
+        cursor.execute('DELETE FROM snapshots WHERE id = ?', (ancien[0],))
+    
+    cursor.execute('''
+        INSERT INTO snapshots
+        (province, code_zone, numero_jour, date_snapshot, taille_brute, sha256)
+        VALUES (?, ?, ?, ?, ?, ?)
+    ''', (province, code_zone, numero_jour, date_snapshot, len(data),
+          hashlib.sha256(data).hexdigest()))
+    snapshot_id = cursor.lastrowid
+    
+    chunks = decouper_chunks(data)
+    hashes = [hashlib.sha256(chunk).hexdigest() for chunk in chunks]
+    
+    # Chunks déjà stockés (requêtes par lots, limite de variables SQLite)
+    connus = set()
+    uniques = list(set(hashes))
+    for i in range(0, len(uniques), 500):
+        lot = uniques[i:i + 500]
+        cursor.execute(
+            f'SELECT hash FROM snapshot_chunks WHERE hash IN ({",".join("?" * len(lot))})', lot
+        )
+        connus.update(row[0] for row in cursor.fetchall())
+    
+    nouveaux_octets = 0
+    nouveaux = []
+    for chunk, chunk_hash in zip(chunks, hashes):
+        if chunk_hash not in connus:
+            connus.add(chunk_hash)
+            compresse = zlib.compress(chunk, CHUNK_COMPRESSION_LEVEL)
+            nouveaux.append((chunk_hash, len(chunk), len(compresse), compresse))
+            nouveaux_octets += len(compresse)
+    
+    cursor.executemany('''
+        INSERT INTO snapshot_chunks (hash, taille_brute, taille_compressee, data)
+        VALUES (?, ?, ?, ?)
+    ''', nouveaux)
+    
+    refs = [(snapshot_id, position, chunk_hash) for position, chunk_hash in enumerate(hashes)]
+    cursor.executemany('''
+        INSERT INTO snapshot_chunk_refs (snapshot_id, position, hash)
+        VALUES (?, ?, ?)
+    ''', refs)
+    
+    if ancien:
+        # Supprimer les chunks qui ne sont plus référencés par aucun snapshot
+        cursor.execute('''
+            DELETE FROM snapshot_chunks
+            WHERE hash NOT IN (SELECT hash FROM snapshot_chunk_refs)
+        ''')
+    
+    return {
+        'taille_brute': len(data),
+        'octets_stockes': nouveaux_octets,
+        'nb_chunks': len(refs)
+    }
+
+def materialiser_snapshot(province, code_zone, date_snapshot):
+    """
+    Reconstruit le geopackage d'un jour passé (décompression + concaténation)
+    dans un fichier temporaire de SNAPSHOT_FOLDER, que l'appelant doit supprimer.
+    Retourne le chemin du fichier, ou None si aucun snapshot n'existe.
+    """
+    conn = sqlite3.connect(DATABASE_PATH)
+    cursor = conn.cursor()
+    
+    cursor.execute('''
+        SELECT id, sha256
+        FROM snapshots
+        WHERE province = ? AND code_zone = ? AND date_snapshot = ?
+    ''', (province, code_zone, date_snapshot))
+    
+    snapshot = cursor.fetchone()
+    if not snapshot:
+        conn.close()
+        return None
+    
+    snapshot_id, sha256 = snapshot
+    
+    cursor.execute('''
+        SELECT c.data
+        FROM snapshot_chunk_refs r
+        JOIN snapshot_chunks c ON c.hash = r.hash
+        WHERE r.snapshot_id = ?
+        ORDER BY r.position
+    ''', (snapshot_id,))
+    
+    decompress = zlib.decompress
+    data = b''.join(decompress(row[0]) for row in cursor)
+    conn.close()
+    
+    if hashlib.sha256(data).hexdigest() != sha256:
+        raise ValueError(f'Snapshot corrompu: {province} {code_zone} {date_snapshot}')
+    
+    fd, path = tempfile.mkstemp(prefix=f'enquete_{province}_{code_zone}_', suffix='.gpkg', dir=SNAPSHOT_FOLDER)
+    with os.fdopen(fd, 'wb') as f:
+        f.write(data)
+    
+    return path
+
+# ============================================================================
+# AVANCEMENT DES ZONES
+# ============================================================================
+
+def enregistrer_avancement_zone(cursor, province, code_zone, numero_jour, date_enquete,
+                                nb_parcelles, surface_enquetee_ha, surface_totale_ha, gpkg_path,
+                                snapshot_path=None):
+    """
+    Met à jour enquete_actuelle, ajoute (ou remplace pour un ré-upload du même
+    jour) la ligne historique_uploads et archive le geopackage de la zone. Ne fait pas de commit (l'appelant gère la transaction).
+    snapshot_path: fichier à archiver s'il n'est pas encore à sa place (gpkg_path)
+    """
+    # Ré-upload du même jour (même date, même numéro de jour): il remplace la
+    # ligne d'historique de ce jour, le différentiel part du jour précédent
+    cursor.execute('''
+        DELETE FROM historique_uploads
+        WHERE province = ? AND code_zone = ? AND date_maj = ? AND numero_jour = ?
+    ''', (province, code_zone, date_enquete, numero_jour))
+    
+    # Récupérer stats précédentes pour calcul différentiel
+    if cursor.rowcount:
+        cursor.execute('''
+            SELECT nb_parcelles, surface_enquetee_ha
+            FROM historique_uploads
+            WHERE province = ? AND code_zone = ?
+            ORDER BY date_maj DESC, id DESC
+            LIMIT 1
+        ''', (province, code_zone))
+    else:
+        cursor.execute('''
+            SELECT nb_parcelles, surface_enquetee_ha
+            FROM enquete_actuelle
+            WHERE province = ? AND code_zone = ?
+        ''', (province, code_zone))
+    
+    stats_precedentes = cursor.fetchone()
+    if stats_precedentes:
+        nb_parcelles_precedent = stats_precedentes[0]
+        surface_precedente_ha = stats_precedentes[1]
+    else:
+        nb_parcelles_precedent = 0
+        surface_precedente_ha = 0
+    
+    surface_restante_ha = surface_totale_ha - surface_enquetee_ha
+    pourcentage_avancement = min((surface_enquetee_ha / surface_totale_ha) * 100, 100)
+    
+    # Calculer différence avec précédent
+    parcelles_ajoutees = nb_parcelles - nb_parcelles_precedent
+    surface_ajoutee_ha = surface_enquetee_ha - surface_precedente_ha
+    
+    # Mettre à jour stats actuelles
+    cursor.execute('''
+        INSERT OR REPLACE INTO enquete_actuelle
+        (province, code_zone, numero_jour, date_enquete, nb_parcelles,
+         surface_enquetee_ha, surface_restante_ha, pourcentage_avancement,
+         geopackage_path, last_update)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+    ''', (province, code_zone, numero_jour, date_enquete, nb_parcelles,
+          round(surface_enquetee_ha, 2), round(surface_restante_ha, 2),
+          round(pourcentage_avancement, 1), gpkg_path))
+    
+    # Ajouter dans historique
+    cursor.execute('''
+        INSERT INTO historique_uploads
+        (province, code_zone, numero_jour, date_maj, nb_parcelles,
+         surface_enquetee_ha, parcelles_ajoutees, surface_ajoutee_ha)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ''', (province, code_zone, numero_jour, date_enquete, nb_parcelles,
+          round(surface_enquetee_ha, 2), parcelles_ajoutees, round(surface_ajoutee_ha, 2)))
+    
+    # Archiver le geopackage du jour (le fichier courant sera écrasé demain)
+    snapshot = enregistrer_snapshot(cursor, province, code_zone, numero_jour, date_enquete,
+                                    snapshot_path or gpkg_path)
+    
+    return {
+        'numero_jour': numero_jour,
+        'nb_parcelles': nb_parcelles,
+        'surface_enquetee_ha': round(surface_enquetee_ha, 2),
+        'surface_restante_ha': round(surface_restante_ha, 2),
+        'pourcentage_avancement': round(pourcentage_avancement, 1),
+        'parcelles_ajoutees': parcelles_ajoutees,
+        'surface_ajoutee_ha': round(surface_ajoutee_ha, 2),
+        'snapshot': snapshot
+    }
+
+def extraire_parcelles_gpkg(source_path, dest_path, fids):
+    """
+    Crée le geopackage d'une zone à partir du geopackage consolidé de la province:
+    copie du fichier, suppression des PARCELLES hors zone (les autres
+    couches, dont PROPRIETAIRES, sont conservées telles quelles) puis VACUUM
+    pour que le fichier ne garde que les pages de la zone.
+    fids: identifiants (fid) des parcelles à garder.
+    Un geopackage étant une base SQLite, pas besoin de réécrire via GDAL.
+    """
+    shutil.copyfile(source_path, dest_path)
+    
+    conn = sqlite3.connect(dest_path)
+    cursor = conn.cursor()
+    
+    # fid = INTEGER PRIMARY KEY de la table, donc alias du rowid
+    garder = {int(fid) for fid in fids}
+    cursor.execute('SELECT rowid FROM "PARCELLES"')
+    cursor.executemany(
+        'DELETE FROM "PARCELLES" WHERE rowid = ?',
+        [(row[0],) for row in cursor.fetchall() if row[0] not in garder]
+    )
+    
     conn.commit()
+    cursor.execute('VACUUM')
     conn.close()
-    print("✅ Base de données initialisée!")
+
+# ============================================================================
+# API: COMPRESSION, PROJECTION DES CHAMPS, PAGINATION
+# ============================================================================
+
+@app.after_request
+def compresser_reponse(response):
+    """Compresse les réponses JSON (brotli si disponible, sinon gzip)"""
+    if (response.mimetype != 'application/json'
+            or response.direct_passthrough
+            or 'Content-Encoding' in response.headers):
+        return response
+    
+    response.vary.add('Accept-Encoding')
+    
+    data = response.get_data()
+    if len(data) < COMPRESSION_MIN_SIZE:
+        return response
+    
+    if brotli and request.accept_encodings.quality('br') > 0:
+        response.set_data(brotli.compress(data, quality=BROTLI_QUALITY))
+        response.headers['Content-Encoding'] = 'br'
+    elif request.accept_encodings.quality('gzip') > 0:
+        response.set_data(gzip.compress(data, compresslevel=GZIP_LEVEL))
+        response.headers['Content-Encoding'] = 'gzip'
+    
+    return response
+
+def get_parametre(nom):
+    """Paramètre de requête: corps JSON (routes POST) ou query string"""
+    data = request.get_json(silent=True) or {}
+    if data.get(nom) is not None:
+        return data[nom]
+    return request.args.get(nom)
+
+def get_champs_demandes():
+    """Champs demandés via fields=a,b,c (None = tous les champs)"""
+    fields = get_parametre('fields')
+    if not fields:
+        return None
+    if isinstance(fields, str):
+        fields = fields.split(',')
+    return {f.strip() for f in fields if f.strip()}
+
+def projeter_champs(data, champs):
+    """Ne garde que les champs demandés d'un dict"""
+    if champs is None:
+        return data
+    return {k: v for k, v in data.items() if k in champs}
+
+def parser_limit(limit):
+    """Taille de page: entier >= 1, plafonné à HISTORIQUE_LIMIT_MAX (ValueError sinon)"""
+    if isinstance(limit, bool) or not isinstance(limit, (int, str)):
+        raise ValueError(f'limit invalide: {limit!r}')
+    limit = int(limit)
+    if limit < 1:
+        raise ValueError(f'limit invalide: {limit!r}')
+    return min(limit, HISTORIQUE_LIMIT_MAX)
+
+def encoder_curseur(date_maj, id_upload):
+    """Curseur opaque de pagination de l'historique"""
+    return base64.urlsafe_b64encode(json.dumps([date_maj, id_upload]).encode()).decode()
+
+def decoder_curseur(curseur):
+    """Curseur -> (date_maj, id); ValueError si le curseur est invalide"""
+    if not isinstance(curseur, str):
+        raise ValueError(f'cursor invalide: {curseur!r}')
+    date_maj, id_upload = json.loads(base64.urlsafe_b64decode(curseur.encode()))
+    if not isinstance(date_maj, str) or isinstance(id_upload, bool) or not isinstance(id_upload, int):
+        raise ValueError(f'cursor invalide: {curseur!r}')
+    return date_maj, id_upload
 
 # ============================================================================
 # ROUTES
@@ -235,6 +708,8 @@ def get_all_zones():
     rows = cursor.fetchall()
     conn.close()
     
+    champs = get_champs_demandes()
+    
     # Organiser par province
     zones_by_province = {}
     for row in rows:
@@ -258,7 +733,7 @@ def get_all_zones():
             'pourcentage_avancement': round(row[12], 1) if row[12] else 0,
             'statut': 'cloturee' if row[6] else 'en_cours'
         }
-        zones_by_province[province].append(zone_data)
+        zones_by_province[province].append(projeter_champs(zone_data, champs))
     
     return jsonify(zones_by_province)
 
@@ -269,10 +744,23 @@ def get_zones(province):
 
 @app.route('/api/zone/info', methods=['POST'])
 def get_zone_info():
+    """
+    Infos d'une zone avec son historique
+    fields=a,b,c: projection des champs; limit + cursor: pagination de l'historique
+    """
     data = request.json
     province = data.get('province')
     code_zone = data.get('code_zone')
     
+    champs = get_champs_demandes()
+    try:
+        limit = get_parametre('limit')
+        limit = parser_limit(limit) if limit is not None else None
+        curseur = get_parametre('cursor')
+        curseur = decoder_curseur(curseur) if curseur else None
+    except (ValueError, TypeError):
+        return jsonify({'error': 'Paramètres de pagination invalides'}), 400
+    
     conn = sqlite3.connect(DATABASE_PATH)
     cursor = conn.cursor()
     
@@ -297,26 +785,52 @@ def get_zone_info():
     
     stats = cursor.fetchone()
     
-    # Récupérer historique
+    # Dernier upload (avancement journalier), indépendant de la pagination
     cursor.execute('''
-        SELECT date_maj, numero_jour, nb_parcelles, surface_enquetee_ha,
-               parcelles_ajoutees, surface_ajoutee_ha
+        SELECT parcelles_ajoutees, surface_ajoutee_ha
         FROM historique_uploads
         WHERE province = ? AND code_zone = ?
-        ORDER BY date_maj ASC
+        ORDER BY date_maj DESC, id DESC
+        LIMIT 1
     ''', (province, code_zone))
     
-    historique_rows = cursor.fetchall()
+    dernier = cursor.fetchone()
+    
+    # Récupérer historique (pagination par curseur sur date_maj, id)
     historique = []
-    for row in historique_rows:
-        historique.append({
-            'date_maj': row[0],
-            'numero_jour': row[1],
-            'nb_parcelles': row[2],
-            'surface_enquetee_ha': round(row[3], 2) if row[3] else 0,
-            'parcelles_ajoutees': row[4],
-            'surface_ajoutee_ha': round(row[5], 2) if row[5] else 0
-        })
+    curseur_suivant = None
+    if champs is None or 'historique' in champs:
+        sql = '''
+            SELECT date_maj, numero_jour, nb_parcelles, surface_enquetee_ha,
+                   parcelles_ajoutees, surface_ajoutee_ha, id
+            FROM historique_uploads
+            WHERE province = ? AND code_zone = ?
+        '''
+        params = [province, code_zone]
+        if curseur:
+            sql += ' AND (date_maj, id) > (?, ?)'
+            params += [curseur[0], curseur[1]]
+        sql += ' ORDER BY date_maj ASC, id ASC'
+        if limit:
+            sql += ' LIMIT ?'
+            params.append(limit + 1)
+        
+        cursor.execute(sql, params)
+        historique_rows = cursor.fetchall()
+        
+        if limit and len(historique_rows) > limit:
+            historique_rows = historique_rows[:limit]
+            curseur_suivant = encoder_curseur(historique_rows[-1][0], historique_rows[-1][6])
+        
+        for row in historique_rows:
+            historique.append({
+                'date_maj': row[0],
+                'numero_jour': row[1],
+                'nb_parcelles': row[2],
+                'surface_enquetee_ha': round(row[3], 2) if row[3] else 0,
+                'parcelles_ajoutees': row[4],
+                'surface_ajoutee_ha': round(row[5], 2) if row[5] else 0
+            })
     
     conn.close()
     
@@ -330,7 +844,8 @@ def get_zone_info():
         'date_debut_enquete': zone[3],
         'cloturee': bool(zone[4]),
         'date_cloture': zone[5],
-        'historique': historique
+        'historique': historique,
+        'historique_curseur_suivant': curseur_suivant
     }
     
     if stats:
@@ -344,10 +859,9 @@ def get_zone_info():
         })
         
         # Calculer avancement journalier (dernier upload)
-        if len(historique) > 0:
-            dernier = historique[-1]
-            result['parcelles_ajoutees_aujourd_hui'] = dernier['parcelles_ajoutees']
-            result['surface_ajoutee_aujourd_hui'] = dernier['surface_ajoutee_ha']
+        if dernier:
+            result['parcelles_ajoutees_aujourd_hui'] = dernier[0]
+            result['surface_ajoutee_aujourd_hui'] = round(dernier[1], 2) if dernier[1] else 0
         else:
             result['parcelles_ajoutees_aujourd_hui'] = 0
             result['surface_ajoutee_aujourd_hui'] = 0
@@ -363,7 +877,11 @@ def get_zone_info():
             'surface_ajoutee_aujourd_hui': 0
         })
     
-    return jsonify(result)
+    # Le curseur accompagne toujours l'historique, sinon impossible de paginer
+    if champs is not None and 'historique' in champs:
+        champs = champs | {'historique_curseur_suivant'}
+    
+    return jsonify(projeter_champs(result, champs))
 
 @app.route('/api/zone/cloturer', methods=['POST'])
 def cloturer_zone():
@@ -418,6 +936,10 @@ def decloturer_zone():
 @app.route('/api/upload/limite', methods=['POST'])
 def upload_limite():
     try:
+        import geopandas as gpd
+        from shapely.geometry import mapping
+        from shapely.ops import unary_union
+        
         file = request.files['file']
         province = request.form['province']
         code_zone = request.form['code_zone']
@@ -467,6 +989,9 @@ def upload_limite():
 @app.route('/api/upload/enquete', methods=['POST'])
 def upload_enquete():
     try:
+        import geopandas as gpd
+        from shapely.geometry import shape
+        
         file = request.files['file']
         province = request.form['province']
         code_zone = request.form['code_zone']
@@ -496,21 +1021,6 @@ def upload_enquete():
         surface_totale_ha = zone[0]
         geom_limite_json = zone[1]
         
-        # Récupérer stats précédentes pour calcul différentiel
-        cursor.execute('''
-            SELECT nb_parcelles, surface_enquetee_ha
-            FROM enquete_actuelle
-            WHERE province = ? AND code_zone = ?
-        ''', (province, code_zone))
-        
-        stats_precedentes = cursor.fetchone()
-        if stats_precedentes:
-            nb_parcelles_precedent = stats_precedentes[0]
-            surface_precedente_ha = stats_precedentes[1]
-        else:
-            nb_parcelles_precedent = 0
-            surface_precedente_ha = 0
-        
         geom_limite = shape(json.loads(geom_limite_json))
         limite_gdf = gpd.GeoDataFrame([1], geometry=[geom_limite], crs='EPSG:26191')
         
@@ -528,72 +1038,256 @@ def upload_enquete():
         
         nb_parcelles = len(parcelles_clipped)
         surface_enquetee_ha = parcelles_clipped.geometry.area.sum() / 10000
-        surface_restante_ha = surface_totale_ha - surface_enquetee_ha
-        pourcentage_avancement = min((surface_enquetee_ha / surface_totale_ha) * 100, 100)
-        
-        # Calculer différence avec précédent
-        parcelles_ajoutees = nb_parcelles - nb_parcelles_precedent
-        surface_ajoutee_ha = surface_enquetee_ha - surface_precedente_ha
         
-        # Mettre à jour stats actuelles
-        cursor.execute('''
-            INSERT OR REPLACE INTO enquete_actuelle
-            (province, code_zone, numero_jour, date_enquete, nb_parcelles,
-             surface_enquetee_ha, surface_restante_ha, pourcentage_avancement,
-             geopackage_path, last_update)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
-        ''', (province, code_zone, numero_jour, date_enquete, nb_parcelles,
-              round(surface_enquetee_ha, 2), round(surface_restante_ha, 2),
-              round(pourcentage_avancement, 1), gpkg_path))
-        
-        # Ajouter dans historique
-        cursor.execute('''
-            INSERT INTO historique_uploads
-            (province, code_zone, numero_jour, date_maj, nb_parcelles,
-             surface_enquetee_ha, parcelles_ajoutees, surface_ajoutee_ha)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (province, code_zone, numero_jour, date_enquete, nb_parcelles,
-              round(surface_enquetee_ha, 2), parcelles_ajoutees, round(surface_ajoutee_ha, 2)))
+        resultat = enregistrer_avancement_zone(
+            cursor, province, code_zone, numero_jour, date_enquete,
+            nb_parcelles, surface_enquetee_ha, surface_totale_ha, gpkg_path
+        )
         
         conn.commit()
         conn.close()
         
-        return jsonify({
+        resultat.update({
             'success': True,
-            'nb_parcelles': nb_parcelles,
-            'surface_enquetee_ha': round(surface_enquetee_ha, 2),
-            'surface_restante_ha': round(surface_restante_ha, 2),
-            'pourcentage_avancement': round(pourcentage_avancement, 1),
-            'parcelles_ajoutees': parcelles_ajoutees,
-            'surface_ajoutee_ha': round(surface_ajoutee_ha, 2),
-            'message': f'{nb_parcelles} parcelles analysées (+{parcelles_ajoutees} aujourd\'hui)'
+            'message': f'{nb_parcelles} parcelles analysées (+{resultat["parcelles_ajoutees"]} aujourd\'hui)'
         })
+        return jsonify(resultat)
         
     except Exception as e:
         import traceback
         traceback.print_exc()
         return jsonify({'success': False, 'error': str(e)}), 500
 
-@app.route('/api/export/ph1/<province>/<code_zone>', methods=['GET'])
-def export_ph1(province, code_zone):
-    """Export PH1 Excel - UNIVERSEL (gère TOUS les formats)"""
+@app.route('/api/upload/enquete/province', methods=['POST'])
+def upload_enquete_province():
+    """
+    Upload d'un geopackage consolidé pour toute une province.
+    Les parcelles sont affectées aux zones par jointure spatiale avec les
+    limites configurées, et toutes les zones sont mises à jour en une transaction.
+    numero_jour (optionnel): sinon jour précédent de chaque zone + 1
+    (inchangé si la zone a déjà été mise à jour aujourd'hui)
+    Les geopackages des zones ne remplacent les fichiers actuels qu'après le commit.
+    """
+    conn = None
+    source_path = None
+    # (fichier temporaire, geopackage de la zone) à mettre en place après le commit
+    fichiers_zones = []
     try:
+        import geopandas as gpd
+        from shapely.geometry import shape
+        
+        file = request.files['file']
+        province = request.form['province']
+        numero_jour_form = request.form.get('numero_jour')
+        
+        # Date = date système automatique
+        date_enquete = datetime.now().strftime('%Y-%m-%d')
+        
         conn = sqlite3.connect(DATABASE_PATH)
         cursor = conn.cursor()
         
         cursor.execute('''
-            SELECT geopackage_path
-            FROM enquete_actuelle
-            WHERE province = ? AND code_zone = ?
-        ''', (province, code_zone))
+            SELECT z.code_zone, z.surface_totale_ha, z.geom_limite, e.numero_jour, e.date_enquete
+            FROM zones z
+            LEFT JOIN enquete_actuelle e ON z.province = e.province AND z.code_zone = e.code_zone
+            WHERE z.province = ? AND z.geom_limite IS NOT NULL
+            ORDER BY z.code_zone
+        ''', (province,))
         
-        result = cursor.fetchone()
+        zones = cursor.fetchall()
         conn.close()
+        conn = None
+        
+        if not zones:
+            return jsonify({
+                'success': False,
+                'error': 'Aucune zone configurée pour cette province, veuillez d\'abord uploader les limites'
+            }), 400
+        
+        # Fichier consolidé temporaire: propre à cette requête, supprimé à la fin
+        fd, source_path = tempfile.mkstemp(prefix=f'enquete_{province}_', suffix='.gpkg', dir=UPLOAD_FOLDER)
+        os.close(fd)
+        file.save(source_path)
         
-        if not result or not result[0]:
-            return jsonify({'error': 'Aucune donnée d\'enquête disponible'}), 404
+        # Seule la géométrie sert ici; index = fid pour extraire les zones par fid
+        parcelles_gdf = gpd.read_file(source_path, layer='PARCELLES', fid_as_index=True, columns=[])
+        
+        if parcelles_gdf.crs is None:
+            parcelles_gdf.set_crs('EPSG:26191', inplace=True)
+        elif parcelles_gdf.crs.to_string() != 'EPSG:26191':
+            parcelles_gdf = parcelles_gdf.to_crs('EPSG:26191')
         
-        gpkg_path = result[0]
+        limites_gdf = gpd.GeoDataFrame(
+            {'code_zone': [z[0] for z in zones]},
+            geometry=[shape(json.loads(z[2])) for z in zones],
+            crs='EPSG:26191'
+        )
+        
+        # Affectation parcelles -> zones (jointure spatiale, index R-tree)
+        paires = gpd.sjoin(parcelles_gdf, limites_gdf, how='inner', predicate='intersects')
+        
+        # Surface découpée par la limite (équivalent de l'overlay par zone)
+        limites_paires = gpd.GeoSeries(
+            limites_gdf.geometry.values[paires['index_right'].values],
+            index=paires.index, crs='EPSG:26191'
+        )
+        paires['surface_m2'] = paires.geometry.intersection(limites_paires, align=False).area
+        paires = paires[paires['surface_m2'] > 0]
+        
+        stats = paires.groupby('code_zone')['surface_m2'].agg(['size', 'sum'])
+        
+        zones_a_ecrire = []
+        zones_sans_parcelles = []
+        
+        # 1) Extraction des geopackages des zones, hors transaction
+        for code_zone, surface_totale_ha, _, numero_jour_precedent, date_precedente in zones:
+            if code_zone not in stats.index:
+                # Zone absente du fichier: on ne remet pas son avancement à zéro
+                zones_sans_parcelles.append(code_zone)
+                continue
+            
+            if numero_jour_form:
+                numero_jour = int(numero_jour_form)
+            elif date_precedente == date_enquete:
+                # Ré-upload le même jour: même numéro de jour
+                numero_jour = numero_jour_precedent
+            else:
+                numero_jour = (numero_jour_precedent or 0) + 1
+            
+            gpkg_path = os.path.join(UPLOAD_FOLDER, f'enquete_{province}_{code_zone}.gpkg')
+            temp_path = gpkg_path + '.tmp'
+            fichiers_zones.append((temp_path, gpkg_path))
+            
+            fids = paires.index[paires['code_zone'] == code_zone].unique()
+            extraire_parcelles_gpkg(source_path, temp_path, fids)
+            
+            zones_a_ecrire.append((code_zone, surface_totale_ha, numero_jour, gpkg_path, temp_path))
+        
+        # 2) Écritures en base dans une transaction courte
+        conn = sqlite3.connect(DATABASE_PATH)
+        cursor = conn.cursor()
+        
+        zones_mises_a_jour = {}
+        for code_zone, surface_totale_ha, numero_jour, gpkg_path, temp_path in zones_a_ecrire:
+            zones_mises_a_jour[code_zone] = enregistrer_avancement_zone(
+                cursor, province, code_zone, numero_jour, date_enquete,
+                int(stats.at[code_zone, 'size']), stats.at[code_zone, 'sum'] / 10000,
+                surface_totale_ha, gpkg_path, snapshot_path=temp_path
+            )
+        
+        conn.commit()
+        conn.close()
+        conn = None
+        
+        for temp_path, gpkg_path in fichiers_zones:
+            os.replace(temp_path, gpkg_path)
+        fichiers_zones = []
+        
+        parcelles_hors_zones = len(parcelles_gdf) - paires.index.nunique()
+        
+        return jsonify({
+            'success': True,
+            'zones': zones_mises_a_jour,
+            'zones_sans_parcelles': zones_sans_parcelles,
+            'parcelles_hors_zones': parcelles_hors_zones,
+            'message': f'{len(parcelles_gdf)} parcelles réparties sur {len(zones_mises_a_jour)} zones'
+        })
+        
+    except Exception as e:
+        import traceback
+        traceback.print_exc()
+        
+        if conn is not None:
+            conn.rollback()
+            conn.close()
+        
+        return jsonify({'success': False, 'error': str(e)}), 500
+    
+    finally:
+        for temp_path, _ in fichiers_zones:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+        if source_path and os.path.exists(source_path):
+            os.remove(source_path)
+
+@app.route('/api/snapshots/<province>/<code_zone>', methods=['GET'])
+def get_snapshots(province, code_zone):
+    """Lister les snapshots d'une zone avec les économies de stockage"""
+    conn = sqlite3.connect(DATABASE_PATH)
+    cursor = conn.cursor()
+    
+    cursor.execute('''
+        SELECT date_snapshot, numero_jour, taille_brute
+        FROM snapshots
+        WHERE province = ? AND code_zone = ?
+        ORDER BY date_snapshot ASC
+    ''', (province, code_zone))
+    
+    snapshots = [{
+        'date': row[0],
+        'numero_jour': row[1],
+        'taille_brute': row[2]
+    } for row in cursor.fetchall()]
+    
+    # Octets réellement stockés pour cette zone (chunks uniques, compressés)
+    cursor.execute('''
+        SELECT COALESCE(SUM(taille_compressee), 0)
+        FROM snapshot_chunks
+        WHERE hash IN (
+            SELECT r.hash
+            FROM snapshot_chunk_refs r
+            JOIN snapshots s ON s.id = r.snapshot_id
+            WHERE s.province = ? AND s.code_zone = ?
+        )
+    ''', (province, code_zone))
+    taille_stockee = cursor.fetchone()[0]
+    conn.close()
+    
+    taille_brute = sum(s['taille_brute'] or 0 for s in snapshots)
+    
+    return jsonify({
+        'province': province,
+        'code_zone': code_zone,
+        'snapshots': snapshots,
+        'taille_brute_totale': taille_brute,
+        'taille_stockee': taille_stockee,
+        'economie_pourcentage': round((1 - taille_stockee / taille_brute) * 100, 1) if taille_brute else 0
+    })
+
+@app.route('/api/export/ph1/<province>/<code_zone>', methods=['GET'])
+def export_ph1(province, code_zone):
+    """
+    Export PH1 Excel - UNIVERSEL (gère TOUS les formats)
+    ?date=YYYY-MM-DD pour exporter un snapshot d'un jour passé
+    """
+    snapshot_path = None
+    try:
+        import geopandas as gpd
+        import pandas as pd
+        
+        date_snapshot = request.args.get('date')
+        
+        if date_snapshot:
+            gpkg_path = snapshot_path = materialiser_snapshot(province, code_zone, date_snapshot)
+            if not gpkg_path:
+                return jsonify({'error': f'Aucun snapshot pour le {date_snapshot}'}), 404
+        else:
+            conn = sqlite3.connect(DATABASE_PATH)
+            cursor = conn.cursor()
+            
+            cursor.execute('''
+                SELECT geopackage_path
+                FROM enquete_actuelle
+                WHERE province = ? AND code_zone = ?
+            ''', (province, code_zone))
+            
+            result = cursor.fetchone()
+            conn.close()
+            
+            if not result or not result[0]:
+                return jsonify({'error': 'Aucune donnée d\'enquête disponible'}), 404
+            
+            gpkg_path = result[0]
         
         if not os.path.exists(gpkg_path):
             return jsonify({'error': 'Fichier geopackage introuvable'}), 404
@@ -706,7 +1400,8 @@ def export_ph1(province, code_zone):
         
         output.seek(0)
         
-        filename = f'PH1_{province}_{code_zone}_{datetime.now().strftime("%Y%m%d")}.xlsx'
+        date_fichier = date_snapshot.replace('-', '') if date_snapshot else datetime.now().strftime("%Y%m%d")
+        filename = f'PH1_{province}_{code_zone}_{date_fichier}.xlsx'
         
         return send_file(
             output,
@@ -719,6 +1414,11 @@ def export_ph1(province, code_zone):
         import traceback
         traceback.print_exc()
         return jsonify({'error': str(e)}), 500
+    
+    finally:
+        # Le geopackage reconstruit n'est gardé que le temps de l'export
+        if snapshot_path and os.path.exists(snapshot_path):
+            os.remove(snapshot_path)
 
 if __name__ == '__main__':
     init_database()
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmark des réponses API sur un gros historique (base temporaire)
+
+    python bench_api.py [nb_uploads]
+
+Mesure la taille de /api/zone/info (brute, gzip, brotli, paginée, fields=)
+et le temps de sérialisation json vs orjson.
+"""
+
+import os
+import sys
+import json
+import time
+import tempfile
+import sqlite3
+
+import app
+
+
+def remplir_base(nb_uploads):
+    conn = sqlite3.connect(app.DATABASE_PATH)
+    cursor = conn.cursor()
+    cursor.execute('''
+        INSERT INTO zones (province, code_zone, nom_zone, enqueteur, date_debut_enquete, surface_totale_ha)
+        VALUES ('Larache', 'L1', 'Bni Bourahou bni Garfett', 'bench', '2025-01-01', 5000)
+    ''')
+    cursor.executemany('''
+        INSERT INTO historique_uploads
+        (province, code_zone, numero_jour, date_maj, nb_parcelles,
+         surface_enquetee_ha, parcelles_ajoutees, surface_ajoutee_ha)
+        VALUES ('Larache', 'L1', ?, ?, ?, ?, ?, ?)
+    ''', [(i + 1, f'{2025 + i // 365:04d}-{(i // 28) % 12 + 1:02d}-{i % 28 + 1:02d}',
+           i * 7, i * 1.2345, 7, 1.2345) for i in range(nb_uploads)])
+    conn.commit()
+    conn.close()
+
+
+def chrono(fonction, repetitions=20):
+    debut = time.perf_counter()
+    for _ in range(repetitions):
+        fonction()
+    return (time.perf_counter() - debut) / repetitions * 1000
+
+
+def main():
+    nb_uploads = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+
+    with tempfile.TemporaryDirectory() as dossier:
+        app.DATABASE_PATH = os.path.join(dossier, 'bench.db')
+        app.init_database()
+        remplir_base(nb_uploads)
+
+        client = app.app.test_client()
+        corps = {'province': 'Larache', 'code_zone': 'L1'}
+
+        def taille(encodage='identity', **extra):
+            r = client.post('/api/zone/info', json=dict(corps, **extra),
+                            headers={'Accept-Encoding': encodage})
+            return len(r.data)
+
+        print(f'/api/zone/info, {nb_uploads} lignes historique_uploads')
+        print(f'  brut            {taille():>10} octets')
+        print(f'  gzip            {taille("gzip"):>10} octets')
+        if app.brotli:
+            print(f'  brotli          {taille("br"):>10} octets')
+        print(f'  limit=100       {taille(limit=100):>10} octets')
+        print(f'  fields=...      {taille(fields="nom_zone,pourcentage_avancement"):>10} octets')
+
+        historique = client.post('/api/zone/info', json=corps,
+                                 headers={'Accept-Encoding': 'identity'}).get_json()
+        print('sérialisation de la réponse complète')
+        print(f'  json            {chrono(lambda: json.dumps(historique)):>10.2f} ms')
+        if app.orjson:
+            print(f'  orjson          {chrono(lambda: app.orjson.dumps(historique)):>10.2f} ms')
+
+        with app.app.test_request_context():
+            print(f'  jsonify         {chrono(lambda: app.jsonify(historique)):>10.2f} ms')
+        print(f'requête complète  {chrono(lambda: taille("br, gzip")):>10.2f} ms')
+
+
+if __name__ == '__main__':
+    main()
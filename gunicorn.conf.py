@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+"""
+Configuration gunicorn
+
+    gunicorn app:app                 # workers légers, pile géospatiale chargée à la demande
+    gunicorn --preload app:app       # pile géospatiale chargée une fois dans le master,
+                                     # partagée par les workers forkés
+    SUIVI_WARMUP=1 gunicorn app:app  # sans --preload: chaque worker se préchauffe au démarrage
+
+Redémarrage (kill -HUP): sans --preload, les nouveaux workers réimportent
+app.py et prennent le nouveau code. Avec --preload, le code est chargé une
+fois dans le master: il faut redémarrer complètement gunicorn.
+"""
+
+import os
+import sys
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:5000')
+workers = int(os.environ.get('GUNICORN_WORKERS', '2'))
+# Les uploads (surtout /api/upload/enquete/province) dépassent vite les 30 s par défaut
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', '120'))
+
+
+def on_starting(server):
+    """Master: migrations une seule fois, avant le fork des workers"""
+    import app
+    app.init_database()
+
+    if server.cfg.preload_app:
+        app.warmup_geospatial()
+    else:
+        # Sans --preload, les workers doivent importer app.py eux-mêmes:
+        # un module laissé en cache dans le master survivrait aux HUP
+        del sys.modules['app']
+
+
+def post_worker_init(worker):
+    """Worker: préchauffage optionnel quand l'application n'est pas préchargée"""
+    if not worker.cfg.preload_app and os.environ.get('SUIVI_WARMUP') == '1':
+        import app
+        app.warmup_geospatial()
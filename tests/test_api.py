@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+"""Tests des réponses JSON: pagination, projection des champs, compression"""
+
+import gzip
+import sqlite3
+
+import pytest
+
+import app
+
+CORPS = {'province': 'Larache', 'code_zone': 'L1'}
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    monkeypatch.setattr(app, 'DATABASE_PATH', str(tmp_path / 'test.db'))
+    app.init_database()
+
+    conn = sqlite3.connect(app.DATABASE_PATH)
+    conn.execute('''
+        INSERT INTO zones (province, code_zone, nom_zone, surface_totale_ha)
+        VALUES ('Larache', 'L1', 'Bni Bourahou bni Garfett', 500)
+    ''')
+    conn.executemany('''
+        INSERT INTO historique_uploads
+        (province, code_zone, numero_jour, date_maj, nb_parcelles,
+         surface_enquetee_ha, parcelles_ajoutees, surface_ajoutee_ha)
+        VALUES ('Larache', 'L1', ?, ?, ?, ?, ?, ?)
+    ''', [(i + 1, f'2025-11-{i // 2 + 1:02d}', i * 10, i * 2.5, 10, 2.5) for i in range(10)])
+    conn.commit()
+    conn.close()
+
+    return app.app.test_client()
+
+
+def zone_info(client, **extra):
+    return client.post('/api/zone/info', json=dict(CORPS, **extra),
+                       headers={'Accept-Encoding': 'identity'})
+
+
+def test_pagination_par_curseur(client):
+    complet = zone_info(client).get_json()
+    assert len(complet['historique']) == 10
+    assert complet['historique_curseur_suivant'] is None
+
+    pages = []
+    curseur = None
+    while True:
+        extra = {'limit': 3}
+        if curseur:
+            extra['cursor'] = curseur
+        reponse = zone_info(client, **extra).get_json()
+        pages.append(reponse['historique'])
+        curseur = reponse['historique_curseur_suivant']
+        if not curseur:
+            break
+
+    assert [len(p) for p in pages] == [3, 3, 3, 1]
+    assert sum(pages, []) == complet['historique']
+
+
+@pytest.mark.parametrize('limit', [-2, 0, True, 'abc', 1.5, ''])
+def test_limit_invalide(client, limit):
+    r = zone_info(client, limit=limit)
+
+    assert r.status_code == 400
+
+
+@pytest.mark.parametrize('curseur', [
+    {'a': 1},
+    ['2025-11-01', 1],
+    42,
+    'pas-un-curseur',
+    app.encoder_curseur(['2025-11-01'], 1),
+    app.encoder_curseur('2025-11-01', '1'),
+    app.encoder_curseur('2025-11-01', True),
+])
+def test_curseur_invalide(client, curseur):
+    r = zone_info(client, limit=3, cursor=curseur)
+
+    assert r.status_code == 400
+    assert r.is_json
+
+
+def test_limit_query_string(client):
+    r = client.post('/api/zone/info?limit=4', json=CORPS)
+
+    assert len(r.get_json()['historique']) == 4
+
+
+def test_fields_garde_le_curseur_avec_historique(client):
+    r = zone_info(client, fields='historique', limit=4).get_json()
+
+    assert set(r) == {'historique', 'historique_curseur_suivant'}
+    assert r['historique_curseur_suivant'] is not None
+
+
+def test_fields_zones_all(client):
+    r = client.get('/api/zones/all?fields=code_zone,pourcentage_avancement')
+
+    assert r.get_json() == {'Larache': [{'code_zone': 'L1', 'pourcentage_avancement': 0}]}
+
+
+def test_compression_gzip(client):
+    brut = zone_info(client).data
+    r = client.post('/api/zone/info', json=CORPS, headers={'Accept-Encoding': 'br;q=0, gzip'})
+
+    assert r.headers['Content-Encoding'] == 'gzip'
+    assert 'Accept-Encoding' in r.headers['Vary']
+    assert gzip.decompress(r.data) == brut
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+"""Tests des migrations versionnées"""
+
+import sqlite3
+
+import pytest
+
+import app
+
+
+@pytest.fixture
+def db_path(tmp_path, monkeypatch):
+    path = str(tmp_path / 'test.db')
+    monkeypatch.setattr(app, 'DATABASE_PATH', path)
+    return path
+
+
+def versions(path):
+    conn = sqlite3.connect(path)
+    rows = conn.execute('SELECT version FROM schema_migrations ORDER BY version').fetchall()
+    conn.close()
+    return [row[0] for row in rows]
+
+
+def test_base_neuve(db_path):
+    app.init_database()
+    app.init_database()
+
+    assert versions(db_path) == [m[0] for m in app.MIGRATIONS]
+
+
+def test_base_heritee_avec_colonnes_deja_ajoutees(db_path):
+    # Base créée par l'ancien code: colonnes ajoutées, pas de schema_migrations
+    conn = sqlite3.connect(db_path)
+    conn.execute('''
+        CREATE TABLE zones (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            province TEXT NOT NULL,
+            code_zone TEXT NOT NULL,
+            nom_zone TEXT NOT NULL,
+            cloturee INTEGER DEFAULT 0,
+            date_cloture DATE,
+            UNIQUE(province, code_zone)
+        )
+    ''')
+    conn.commit()
+    conn.close()
+
+    app.init_database()
+
+    assert versions(db_path) == [m[0] for m in app.MIGRATIONS]
+
+
+def test_colonne_en_double_hors_migrations_heritees(db_path, monkeypatch):
+    app.init_database()
+    version = app.MIGRATIONS[-1][0] + 1
+    monkeypatch.setattr(app, 'MIGRATIONS', app.MIGRATIONS + [
+        (version, 'Colonne déjà existante', ['ALTER TABLE zones ADD COLUMN cloturee INTEGER'])
+    ])
+
+    with pytest.raises(sqlite3.OperationalError):
+        app.init_database()
+
+    assert version not in versions(db_path)
+
+
+def test_migration_en_echec_annulee(db_path, monkeypatch):
+    app.init_database()
+    version = app.MIGRATIONS[-1][0] + 1
+    migration = (version, 'Colonne puis erreur', [
+        'ALTER TABLE zones ADD COLUMN test_colonne TEXT',
+        'ALTER TABLE table_inexistante ADD COLUMN x TEXT'
+    ])
+    monkeypatch.setattr(app, 'MIGRATIONS', app.MIGRATIONS + [migration])
+
+    with pytest.raises(sqlite3.OperationalError):
+        app.init_database()
+
+    # Rien n'est resté: la migration corrigée peut être rejouée
+    conn = sqlite3.connect(db_path)
+    colonnes = [row[1] for row in conn.execute('PRAGMA table_info(zones)')]
+    conn.close()
+    assert 'test_colonne' not in colonnes
+    assert version not in versions(db_path)
+
+    monkeypatch.setattr(app, 'MIGRATIONS', app.MIGRATIONS[:-1] + [
+        (version, 'Colonne', ['ALTER TABLE zones ADD COLUMN test_colonne TEXT'])
+    ])
+    app.init_database()
+    assert version in versions(db_path)
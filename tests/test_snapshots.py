@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+"""Tests du stockage des snapshots: découpage -> stockage -> reconstruction"""
+
+import os
+import sqlite3
+
+import pytest
+
+import app
+
+
+@pytest.fixture
+def base(tmp_path, monkeypatch):
+    monkeypatch.setattr(app, 'DATABASE_PATH', str(tmp_path / 'test.db'))
+    monkeypatch.setattr(app, 'SNAPSHOT_FOLDER', str(tmp_path / 'snapshots'))
+    os.makedirs(app.SNAPSHOT_FOLDER)
+    app.init_database()
+    return tmp_path
+
+
+def creer_geopackage(path, nb_lignes, page_size=4096):
+    """Fichier SQLite quelconque, modifié en place comme un geopackage"""
+    conn = sqlite3.connect(path)
+    conn.execute(f'PRAGMA page_size = {page_size}')
+    conn.execute('CREATE TABLE IF NOT EXISTS parcelles (id INTEGER PRIMARY KEY, nom TEXT)')
+    conn.executemany('INSERT INTO parcelles (nom) VALUES (?)',
+                     [(f'parcelle {i} ' * 20,) for i in range(nb_lignes)])
+    conn.commit()
+    conn.close()
+
+
+def archiver(path, date_snapshot):
+    conn = sqlite3.connect(app.DATABASE_PATH)
+    resultat = app.enregistrer_snapshot(conn.cursor(), 'Larache', 'L1', 1, date_snapshot, path)
+    conn.commit()
+    conn.close()
+    return resultat
+
+
+def lire(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def test_decouper_chunks_aligne_sur_pages(tmp_path):
+    path = str(tmp_path / 'a.gpkg')
+    creer_geopackage(path, 200, page_size=8192)
+    data = lire(path)
+
+    chunks = app.decouper_chunks(data)
+
+    assert app.taille_page_sqlite(data) == 8192
+    assert b''.join(chunks) == data
+    assert all(len(chunk) == 8192 for chunk in chunks)
+
+
+def test_decouper_chunks_fichier_non_sqlite():
+    data = b'x' * 10000
+
+    chunks = app.decouper_chunks(data)
+
+    assert b''.join(chunks) == data
+    assert len(chunks[0]) == app.CHUNK_SIZE_DEFAUT
+
+
+def test_aller_retour_snapshots(base):
+    path = str(base / 'enquete.gpkg')
+    creer_geopackage(path, 500)
+    jour1 = lire(path)
+    stats1 = archiver(path, '2025-11-25')
+
+    creer_geopackage(path, 20)
+    jour2 = lire(path)
+    stats2 = archiver(path, '2025-11-26')
+
+    # Jour 2: seules les pages modifiées ou ajoutées sont stockées
+    assert stats2['octets_stockes'] < stats1['octets_stockes'] / 2
+
+    for date_snapshot, attendu in (('2025-11-25', jour1), ('2025-11-26', jour2)):
+        rebuilt = app.materialiser_snapshot('Larache', 'L1', date_snapshot)
+        try:
+            assert lire(rebuilt) == attendu
+        finally:
+            os.remove(rebuilt)
+
+    assert app.materialiser_snapshot('Larache', 'L1', '2025-11-27') is None
+
+
+def test_remplacement_snapshot_du_jour(base):
+    path = str(base / 'enquete.gpkg')
+    creer_geopackage(path, 300)
+    archiver(path, '2025-11-25')
+
+    os.remove(path)
+    creer_geopackage(path, 50)
+    archiver(path, '2025-11-25')
+
+    conn = sqlite3.connect(app.DATABASE_PATH)
+    orphelins = conn.execute('''
+        SELECT COUNT(*) FROM snapshot_chunks
+        WHERE hash NOT IN (SELECT hash FROM snapshot_chunk_refs)
+    ''').fetchone()[0]
+    conn.close()
+
+    assert orphelins == 0
+    rebuilt = app.materialiser_snapshot('Larache', 'L1', '2025-11-25')
+    try:
+        assert lire(rebuilt) == lire(path)
+    finally:
+        os.remove(rebuilt)
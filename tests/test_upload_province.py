@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+"""Tests de l'upload consolidé par province (/api/upload/enquete/province)"""
+
+import os
+import sqlite3
+
+import pytest
+
+gpd = pytest.importorskip('geopandas')
+pyogrio = pytest.importorskip('pyogrio')
+pd = pytest.importorskip('pandas')
+
+import app  # noqa: E402
+
+DATA = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data', 'uploads')
+ZONES = ['L1', 'L2']
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    monkeypatch.setattr(app, 'DATABASE_PATH', str(tmp_path / 'test.db'))
+    monkeypatch.setattr(app, 'UPLOAD_FOLDER', str(tmp_path / 'uploads'))
+    monkeypatch.setattr(app, 'SNAPSHOT_FOLDER', str(tmp_path / 'snapshots'))
+    os.makedirs(app.UPLOAD_FOLDER)
+    os.makedirs(app.SNAPSHOT_FOLDER)
+    app.init_database()
+
+    client = app.app.test_client()
+    for code_zone in ZONES:
+        envoyer(client, '/api/upload/limite', os.path.join(DATA, f'limite_Larache_{code_zone}.gpkg'),
+                code_zone=code_zone, enqueteur='test', date_debut_enquete='2025-01-01')
+    return client
+
+
+@pytest.fixture
+def consolide(tmp_path):
+    """Geopackage consolidé Larache = parcelles et propriétaires de L1 + L2"""
+    path = str(tmp_path / 'consolide.gpkg')
+    sources = [os.path.join(DATA, f'enquete_Larache_{code_zone}.gpkg') for code_zone in ZONES]
+
+    parcelles = [gpd.read_file(source, layer='PARCELLES') for source in sources]
+    colonnes = [c for c in parcelles[0].columns if c in parcelles[1].columns]
+    gpd.GeoDataFrame(pd.concat([p[colonnes] for p in parcelles], ignore_index=True)).to_file(
+        path, layer='PARCELLES', driver='GPKG')
+
+    proprietaires = [pyogrio.read_dataframe(source, layer='PROPRIETAIRES') for source in sources]
+    colonnes = [c for c in proprietaires[0].columns if c in proprietaires[1].columns]
+    pyogrio.write_dataframe(pd.concat([p[colonnes] for p in proprietaires], ignore_index=True),
+                            path, layer='PROPRIETAIRES')
+    return path
+
+
+def envoyer(client, url, path, **form):
+    with open(path, 'rb') as f:
+        form.update({'province': 'Larache', 'file': (f, os.path.basename(path))})
+        return client.post(url, data=form, content_type='multipart/form-data')
+
+
+def test_upload_province(client, consolide):
+    r = envoyer(client, '/api/upload/enquete/province', consolide)
+
+    assert r.status_code == 200
+    zones = r.get_json()['zones']
+    assert {z: zones[z]['nb_parcelles'] for z in ZONES} == {'L1': 54, 'L2': 358}
+
+    taille_consolide = os.path.getsize(consolide)
+    for code_zone in ZONES:
+        path = os.path.join(app.UPLOAD_FOLDER, f'enquete_Larache_{code_zone}.gpkg')
+        assert len(gpd.read_file(path, layer='PARCELLES')) == zones[code_zone]['nb_parcelles']
+        # VACUUM: le fichier de la zone ne garde que ses pages
+        assert os.path.getsize(path) < taille_consolide
+
+    # Ni fichier temporaire, ni fichier consolidé conservé
+    assert sorted(os.listdir(app.UPLOAD_FOLDER)) == sorted(
+        [f'limite_Larache_{z}.gpkg' for z in ZONES] + [f'enquete_Larache_{z}.gpkg' for z in ZONES])
+
+
+def test_upload_province_fids_non_contigus(client, consolide):
+    # Parcelles supprimées dans QGIS: les fid ne suivent plus les positions
+    conn = sqlite3.connect(consolide)
+    conn.execute('DELETE FROM "PARCELLES" WHERE fid <= 10')
+    conn.commit()
+    conn.close()
+
+    r = envoyer(client, '/api/upload/enquete/province', consolide)
+
+    assert r.get_json()['zones']['L1']['nb_parcelles'] == 44
+    path = os.path.join(app.UPLOAD_FOLDER, 'enquete_Larache_L1.gpkg')
+    fids = gpd.read_file(path, layer='PARCELLES', fid_as_index=True, columns=[]).index
+    assert sorted(fids) == list(range(11, 55))
+
+
+def test_reupload_meme_jour(client, consolide):
+    premier = envoyer(client, '/api/upload/enquete/province', consolide).get_json()
+    second = envoyer(client, '/api/upload/enquete/province', consolide).get_json()
+
+    for code_zone in ZONES:
+        assert premier['zones'][code_zone]['numero_jour'] == 1
+        assert second['zones'][code_zone]['numero_jour'] == 1
+        # Différentiel calculé par rapport à la veille, pas au premier upload du jour
+        assert second['zones'][code_zone]['parcelles_ajoutees'] == premier['zones'][code_zone]['parcelles_ajoutees']
+
+    conn = sqlite3.connect(app.DATABASE_PATH)
+    lignes = conn.execute('SELECT code_zone, numero_jour FROM historique_uploads ORDER BY code_zone').fetchall()
+    conn.close()
+    assert lignes == [('L1', 1), ('L2', 1)]
+
+
+def test_upload_province_atomique(client, consolide, monkeypatch):
+    enregistrer_snapshot = app.enregistrer_snapshot
+
+    def echec_deuxieme_zone(cursor, province, code_zone, *args):
+        if code_zone == 'L2':
+            raise OSError('disque plein')
+        return enregistrer_snapshot(cursor, province, code_zone, *args)
+
+    monkeypatch.setattr(app, 'enregistrer_snapshot', echec_deuxieme_zone)
+
+    r = envoyer(client, '/api/upload/enquete/province', consolide)
+
+    assert r.status_code == 500
+    assert r.get_json()['success'] is False
+    # Ni fichier de zone remplacé, ni fichier temporaire, ni ligne en base
+    assert sorted(os.listdir(app.UPLOAD_FOLDER)) == ['limite_Larache_L1.gpkg', 'limite_Larache_L2.gpkg']
+    conn = sqlite3.connect(app.DATABASE_PATH)
+    assert conn.execute('SELECT COUNT(*) FROM enquete_actuelle').fetchone()[0] == 0
+    assert conn.execute('SELECT COUNT(*) FROM historique_uploads').fetchone()[0] == 0
+    conn.close()